@@ -8,12 +8,14 @@
 
 # ── Modal ─────────────────────────────────────────────────────
 MODAL_APP_NAME = "ayurparam-service"
+MODAL_WEB_LABEL = "ayurparam-service-fastapi-app"   # public URL subdomain
 MODAL_SECRET_UMLS = "my-umls-secret"
 MODAL_SECRET_GROQ = "groq-secret"
 
 # ── CPU tier (ASGI + NER + Groq orchestrator) ────────────────
 CPU_TIMEOUT = 1200             # seconds
 CPU_SCALEDOWN_WINDOW = 300     # seconds idle before shutdown
+CPU_MAX_CONCURRENT_INPUTS = 16 # requests multiplexed per container
 
 # ── Groq LLM ─────────────────────────────────────────────────
 GROQ_MODEL = "qwen/qwen3-32b"
@@ -25,16 +27,25 @@ LLM_MAX_TOKENS = 1024
 
 # ── NER ──────────────────────────────────────────────────────
 NER_MODEL_NAME = "en_core_sci_lg"
+# parser stays: NER will not extend an entity across the sentence starts it sets.
+NER_EXCLUDED_COMPONENTS = ["tagger", "attribute_ruler", "lemmatizer"]
+NER_BATCH_SIZE = 16            # max queued texts per nlp.pipe() call
 
 # ── ITA vocabulary ───────────────────────────────────────────
 ITA_CSV_SOURCE_PATH = "who-ita/ita_terms_ascii.csv"
 ITA_CSV_CONTAINER_PATH = "/app/ita_terms_ascii.csv"
 FUZZY_THRESHOLD = 0.80
+ITA_MATCH_CACHE_SIZE = 4096    # memoized (term, threshold) fuzzy matches
 
 # ── UMLS API ─────────────────────────────────────────────────
 UMLS_SEARCH_URL = "https://uts-ws.nlm.nih.gov/rest/search/current"
 UMLS_ATOMS_URL_TEMPLATE = "https://uts-ws.nlm.nih.gov/rest/content/current/CUI/{cui}/atoms"
 UMLS_REQUEST_TIMEOUT = 10      # seconds
+UMLS_POOL_SIZE = 20            # keep-alive connections per host
+UMLS_CONNECT_RETRIES = 2       # retries on connection failure
+UMLS_MAX_CONCURRENCY = 8       # in-flight UMLS calls per container
+UMLS_CACHE_SIZE = 4096         # cached searches / atom lookups per container
+UMLS_CACHE_TTL = 24 * 3600     # seconds
 
 # ── Python version for container images ──────────────────────
 PYTHON_VERSION = "3.11"
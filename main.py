@@ -1,21 +1,28 @@
 import modal
 import os
 import re
+import sys
 import csv
-import io
+import time
 import asyncio
-from dataclasses import dataclass
+import bisect
+import functools
+import math
+from collections import OrderedDict
 from difflib import SequenceMatcher
+from dataclasses import dataclass
 from contextlib import asynccontextmanager
 
 from config import (
-    MODAL_APP_NAME, MODAL_SECRET_UMLS, MODAL_SECRET_GROQ,
-    CPU_TIMEOUT, CPU_SCALEDOWN_WINDOW,
+    MODAL_APP_NAME, MODAL_WEB_LABEL, MODAL_SECRET_UMLS, MODAL_SECRET_GROQ,
+    CPU_TIMEOUT, CPU_SCALEDOWN_WINDOW, CPU_MAX_CONCURRENT_INPUTS,
     GROQ_MODEL, GROQ_RATE_LIMIT_DELAY,
     LLM_TEMPERATURE, LLM_MAX_TOKENS,
-    NER_MODEL_NAME,
-    ITA_CSV_SOURCE_PATH, ITA_CSV_CONTAINER_PATH, FUZZY_THRESHOLD,
+    NER_MODEL_NAME, NER_EXCLUDED_COMPONENTS, NER_BATCH_SIZE,
+    ITA_CSV_SOURCE_PATH, ITA_CSV_CONTAINER_PATH, FUZZY_THRESHOLD, ITA_MATCH_CACHE_SIZE,
     UMLS_SEARCH_URL, UMLS_ATOMS_URL_TEMPLATE, UMLS_REQUEST_TIMEOUT,
+    UMLS_POOL_SIZE, UMLS_CONNECT_RETRIES, UMLS_MAX_CONCURRENCY,
+    UMLS_CACHE_SIZE, UMLS_CACHE_TTL,
     PYTHON_VERSION,
 )
 
@@ -30,8 +37,10 @@ cpu_image = (
         "scispacy==0.5.5",
         "https://s3-us-west-2.amazonaws.com/ai2-s2-scispacy/releases/v0.5.4/en_core_sci_lg-0.5.4.tar.gz",
         "fastapi[standard]==0.109.0",
-        "requests==2.31.0",
+        "httpx[http2]==0.27.0",
         "groq==0.25.0",
+        "rapidfuzz==3.9.7",
+        "orjson==3.10.7",
     )
     .add_local_file(ITA_CSV_SOURCE_PATH, ITA_CSV_CONTAINER_PATH)
     .add_local_file("config.py", "/root/config.py")
@@ -42,73 +51,147 @@ cpu_image = (
 # ITA Vocabulary (ported from ablation/terminology_bridge.py)
 # ===================================================================
 
+_SKT_SPLIT_RE = re.compile(r"[;,]")
+_SKT_NUM_RE = re.compile(r"^\d+\.\s*")
+_TOKEN_RE = re.compile(r"\w{3,}")
+
+
 class ITAVocabulary:
     """WHO-ITA terminology loaded from ita_terms_ascii.csv."""
 
     def __init__(self, filepath=ITA_CSV_CONTAINER_PATH):
-        self.terms = {}           # ita_id -> (english, sanskrit_list)
+        self.terms = {}           # ita_id -> (english, sanskrit_tuple)
         self.sanskrit_index = {}  # lowercase collapsed key -> ita_id
         self.english_index = {}   # lowercase english term -> ita_id
         self._load(filepath)
+        # Parallel arrays for the fuzzy scan, ordered by key length so a
+        # query only has to score the slice whose lengths can reach the
+        # threshold.
+        # _english_order keeps each key's position in english_index so ties
+        # still go to the first key, as in a plain scan of the index.
+        by_len = sorted(
+            enumerate(self.english_index.items()), key=lambda e: len(e[1][0])
+        )
+        self._english_order = tuple(pos for pos, _ in by_len)
+        self._english_keys = tuple(k for _, (k, _) in by_len)
+        self._english_ids = tuple(i for _, (_, i) in by_len)
+        self._english_lens = [len(k) for k in self._english_keys]
+        # word -> positions in _english_keys, for the token pre-pass.
+        self._eng_by_token = {}
+        for i, k in enumerate(self._english_keys):
+            for tok in set(_TOKEN_RE.findall(k)):
+                self._eng_by_token.setdefault(sys.intern(tok), []).append(i)
+        # Per-instance memo: entities like "fatigue" recur across requests.
+        self._cached_match = functools.lru_cache(maxsize=ITA_MATCH_CACHE_SIZE)(self._match)
 
     def _load(self, filepath):
-        with open(filepath, "r", encoding="utf-8-sig") as f:
-            reader = csv.reader(io.StringIO(f.read()))
-            rows = list(reader)
-
-        for row in rows[1:]:
-            if len(row) < 3:
-                continue
-            ita_id = row[0].strip()
-            english = row[1].strip()
-            sanskrit_raw = row[2].strip()
-
-            sanskrit_terms = []
-            for part in re.split(r"[;,]", sanskrit_raw):
-                term = re.sub(r"^\d+\.\s*", "", part).strip()
-                term = term.rstrip("/").strip()
-                if term:
-                    sanskrit_terms.append(term)
-
-            self.terms[ita_id] = (english, sanskrit_terms)
-
-            for st in sanskrit_terms:
-                key = st.lower().replace("-", "").replace(" ", "")
-                self.sanskrit_index[key] = ita_id
-            eng_key = english.lower().strip()
-            self.english_index[eng_key] = ita_id
+        with open(filepath, "r", encoding="utf-8-sig", newline="") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                if len(row) < 3:
+                    continue
+                ita_id = sys.intern(row[0].strip())
+                english = row[1].strip()
+                sanskrit_raw = row[2].strip()
+
+                sanskrit_terms = []
+                for part in _SKT_SPLIT_RE.split(sanskrit_raw):
+                    term = _SKT_NUM_RE.sub("", part).strip()
+                    term = term.rstrip("/").strip()
+                    if term:
+                        sanskrit_terms.append(term)
+
+                sanskrit_terms = tuple(sanskrit_terms)
+                self.terms[ita_id] = (english, sanskrit_terms)
+
+                for st in sanskrit_terms:
+                    key = st.lower().replace("-", "").replace(" ", "")
+                    self.sanskrit_index[sys.intern(key)] = ita_id
+                eng_key = sys.intern(english.lower().strip())
+                self.english_index[eng_key] = ita_id
 
     def find_best_english_match(self, term, threshold=0.60):
         """Fuzzy-match a term against all English terms in the ITA vocabulary."""
-        term_lower = term.lower().strip()
+        return self._cached_match(term.lower().strip(), threshold)
 
+    def _match(self, term_lower, threshold):
         if term_lower in self.english_index:
             ita_id = self.english_index[term_lower]
             english, sanskrit_list = self.terms[ita_id]
             sanskrit = "; ".join(sanskrit_list) if sanskrit_list else ""
             return ita_id, english, sanskrit, 1.0
 
-        best_id = None
-        best_sim = 0.0
-        tl_len = len(term_lower)
-        max_dist_ratio = 1.0 - threshold
-        for eng_key, ita_id in self.english_index.items():
-            ek_len = len(eng_key)
-            max_len = max(tl_len, ek_len)
-            if max_len > 0 and abs(tl_len - ek_len) > max_dist_ratio * max_len:
-                continue
-            sim = SequenceMatcher(None, term_lower, eng_key).ratio()
-            if sim > best_sim:
-                best_sim = sim
-                best_id = ita_id
+        # SequenceMatcher.ratio() <= fuzz.ratio (its matching blocks are a
+        # common subsequence, fuzz.ratio scores the longest one), so RapidFuzz
+        # prunes keys that cannot reach the cutoff and only the survivors are
+        # scored with SequenceMatcher.
+        n = len(term_lower)
+        best = (0.0, None, None)  # (similarity, index order, key position)
+
+        # Keys sharing a word with the term go first; their best similarity
+        # raises the RapidFuzz cutoff for the full scan below.
+        candidates = set()
+        for tok in _TOKEN_RE.findall(term_lower):
+            candidates.update(self._eng_by_token.get(tok, ()))
+        if candidates:
+            idxs = sorted(candidates)
+            best = self._rescore(
+                term_lower, [self._english_keys[i] for i in idxs], idxs,
+                threshold, threshold, best,
+            )
 
-        if best_id and best_sim >= threshold:
+        # The length guard in _rescore only admits keys with
+        # threshold*n <= k <= n/threshold; widened by one so float rounding
+        # never drops a key the guard itself would keep.
+        start, stop = 0, len(self._english_keys)
+        if threshold > 0:
+            lo = math.ceil(n * threshold) - 1
+            hi = math.floor(n / threshold) + 1
+            start = bisect.bisect_left(self._english_lens, lo)
+            stop = bisect.bisect_right(self._english_lens, hi)
+
+        best = self._rescore(
+            term_lower, self._english_keys[start:stop], range(start, stop),
+            threshold, max(threshold, best[0]), best,
+        )
+
+        sim, _, idx = best
+        if idx is not None and sim >= threshold:
+            best_id = self._english_ids[idx]
             english, sanskrit_list = self.terms[best_id]
             sanskrit = "; ".join(sanskrit_list) if sanskrit_list else ""
-            return best_id, english, sanskrit, best_sim
+            return best_id, english, sanskrit, sim
 
         return None
 
+    def _rescore(self, term_lower, keys, positions, threshold, cutoff, best):
+        """Score `keys` (at `positions` in _english_keys) with SequenceMatcher,
+        skipping any whose fuzz.ratio is below `cutoff`, and fold them into
+        `best`. Keys are skipped, as in the original scan, when their length
+        differs from the term's by more than (1 - threshold) of the longer one."""
+        from rapidfuzz import fuzz, process
+
+        n = len(term_lower)
+        max_dist_ratio = 1.0 - threshold
+        # Slack so a key scoring exactly `cutoff` is not lost to rounding.
+        hits = process.extract(
+            term_lower, keys, scorer=fuzz.ratio,
+            score_cutoff=cutoff * 100 - 1e-6, limit=None,
+        )
+        best_sim, best_order, best_idx = best
+        for eng_key, _, i in hits:
+            k = len(eng_key)
+            max_len = max(n, k)
+            if max_len > 0 and abs(n - k) > max_dist_ratio * max_len:
+                continue
+            sim = SequenceMatcher(None, term_lower, eng_key).ratio()
+            idx = positions[i]
+            order = self._english_order[idx]
+            if sim > best_sim or (sim == best_sim and sim > 0 and order < best_order):
+                best_sim, best_order, best_idx = sim, order, idx
+        return best_sim, best_order, best_idx
+
 
 # ===================================================================
 # NER (ported from ablation/terminology_bridge.py)
@@ -124,10 +207,12 @@ _NER_STOPWORDS = {
 }
 
 
-def _extract_entities(nlp, text):
-    """Run scispacy NER on text. Returns list of entity strings."""
-    doc = nlp(text)
+def _extract_entities(doc):
+    """Filter scispacy NER output for a processed doc.
+    Returns: (entity strings for the bridge, entity dicts for the API response)
+    """
     entities = []
+    entity_dicts = []
     seen = set()
     for ent in doc.ents:
         word = ent.text.strip()
@@ -138,91 +223,249 @@ def _extract_entities(nlp, text):
             continue
         seen.add(key)
         entities.append(word)
-    return entities
-
-
-def _extract_entity_dicts(nlp, text):
-    """Run scispacy NER returning dicts for the API response."""
-    doc = nlp(text)
-    entities = []
-    seen = set()
-    for ent in doc.ents:
-        word = ent.text.strip()
-        key = word.lower()
-        if key in seen:
-            continue
-        if len(word) < 4 or key in _NER_STOPWORDS:
-            continue
-        seen.add(key)
-        entities.append({
+        entity_dicts.append({
             "word": word,
             "score": 1.0,
             "entity_group": ent.label_,
         })
-    return entities
+    return entities, entity_dicts
+
+
+class NERBatcher:
+    """Run concurrent requests' texts through one nlp.pipe() call.
+
+    A single worker task owns the (thread-unsafe) spaCy pipeline. Texts
+    that queue up while a batch is running are processed together in the
+    next batch, so a lone request never waits on a timer.
+    """
+
+    def __init__(self, nlp, max_batch=NER_BATCH_SIZE):
+        self.nlp = nlp
+        self.max_batch = max_batch
+        self._queue = asyncio.Queue()
+        self._worker = None
+
+    def start(self):
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, text):
+        """Return the spaCy doc for text."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((text, future))
+        return await future
+
+    def _pipe(self, texts):
+        return list(self.nlp.pipe(texts, batch_size=len(texts)))
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            texts = [text for text, _ in batch]
+            try:
+                docs = await asyncio.to_thread(self._pipe, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), doc in zip(batch, docs):
+                if not future.done():
+                    future.set_result(doc)
 
 
 # ===================================================================
 # UMLS lookup (enhanced from aravind's version — returns 4-tuple)
 # ===================================================================
 
-def _lookup_umls(api_key, keyword):
-    """Search UMLS for a keyword.
-    Returns: (CUI, SNOMED_CODE, PREFERRED_NAME, ICD10_CODE)
-    """
-    import requests
+def _make_umls_client():
+    """Keep-alive HTTP/2 client shared by all UMLS calls in this container."""
+    import httpx
+
+    # Transport-level retries cover connection failures (DNS, refused,
+    # connect timeout); HTTP error responses are handled by the callers.
+    transport = httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=UMLS_CONNECT_RETRIES,
+        limits=httpx.Limits(
+            max_connections=UMLS_POOL_SIZE,
+            max_keepalive_connections=UMLS_POOL_SIZE,
+        ),
+    )
+    return httpx.AsyncClient(
+        transport=transport,
+        timeout=UMLS_REQUEST_TIMEOUT,
+        headers={"User-Agent": "AyurAssist/1.0"},
+    )
 
-    res = ("N/A", "N/A", keyword, "N/A")
-    if not api_key or len(keyword) < 2:
-        return res
 
-    try:
-        params = {"string": keyword, "apiKey": api_key, "returnIdType": "concept"}
-        r = requests.get(UMLS_SEARCH_URL, params=params, timeout=UMLS_REQUEST_TIMEOUT)
-        if r.status_code != 200:
-            return res
+class TTLCache:
+    """Small LRU cache whose entries expire ttl seconds after insertion."""
 
-        results = r.json().get("result", {}).get("results", [])
-        if not results:
-            return res
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()   # key -> (expires_at, value)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        if entry[0] < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return entry[1]
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
 
-        top = results[0]
-        cui = top.get("ui")
-        name = top.get("name")
 
-        snomed = "N/A"
-        icd10 = "N/A"
+# UMLS content changes with its twice-yearly releases, so repeat keywords
+# are served from memory. Only completed responses are stored; HTTP
+# errors are retried on the next request.
+_MISSING = object()
+_UMLS_SEARCH_CACHE = TTLCache(UMLS_CACHE_SIZE, UMLS_CACHE_TTL)  # keyword.lower() -> (cui, name) | None
+_UMLS_ATOMS_CACHE = TTLCache(UMLS_CACHE_SIZE, UMLS_CACHE_TTL)   # cui -> (snomed, icd10)
 
-        atoms_url = UMLS_ATOMS_URL_TEMPLATE.format(cui=cui)
-        r2 = requests.get(atoms_url, params={
+
+class UMLSError(Exception):
+    """Non-200 UMLS response. Carries only the status and keyword, never
+    the request URL (its query string holds the API key)."""
+
+
+def _umls_error_text(e):
+    """Loggable description of a UMLS failure. httpx errors can embed the
+    request URL, apiKey included, so only their type is reported."""
+    return str(e) if isinstance(e, UMLSError) else type(e).__name__
+
+
+async def _umls_search(client, api_key, keyword, sem):
+    """Top UMLS concept for a keyword as (CUI, NAME), or None if nothing
+    matched. Raises UMLSError on a non-200 response and httpx errors on
+    transport failures. `sem` gates the HTTP call."""
+    import orjson
+
+    key = keyword.lower()
+    top = _UMLS_SEARCH_CACHE.get(key, _MISSING)
+    if top is not _MISSING:
+        return top
+
+    params = {"string": keyword, "apiKey": api_key, "returnIdType": "concept"}
+    async with sem:
+        r = await client.get(UMLS_SEARCH_URL, params=params)
+    if r.status_code != 200:
+        raise UMLSError(f"search returned {r.status_code} for '{keyword}'")
+
+    results = orjson.loads(r.content).get("result", {}).get("results", [])
+    top = (results[0].get("ui"), results[0].get("name")) if results else None
+    _UMLS_SEARCH_CACHE.set(key, top)
+    return top
+
+
+async def _umls_codes(client, api_key, cui, sem):
+    """(SNOMED_CODE, ICD10_CODE) for a CUI, "N/A" where missing.
+    Raises on transport errors. `sem` gates the HTTP call."""
+    import orjson
+
+    codes = _UMLS_ATOMS_CACHE.get(cui)
+    if codes is not None:
+        return codes
+
+    snomed = "N/A"
+    icd10 = "N/A"
+
+    atoms_url = UMLS_ATOMS_URL_TEMPLATE.format(cui=cui)
+    async with sem:
+        r2 = await client.get(atoms_url, params={
             "apiKey": api_key,
             "sabs": "SNOMEDCT_US,ICD10CM",
             "ttys": "PT",
             "pageSize": 20,
-        }, timeout=UMLS_REQUEST_TIMEOUT)
-
-        if r2.status_code == 200:
-            for atom in r2.json().get("result", []):
-                src = atom.get("rootSource")
-                if src == "SNOMEDCT_US" and snomed == "N/A":
-                    code = atom.get("code", "").split("/")[-1]
-                    snomed = code
-                if src == "ICD10CM" and icd10 == "N/A":
-                    code = atom.get("code", "").split("/")[-1]
-                    icd10 = code
+        })
 
+    if r2.status_code == 200:
+        for atom in orjson.loads(r2.content).get("result", []):
+            src = atom.get("rootSource")
+            if src == "SNOMEDCT_US" and snomed == "N/A":
+                code = atom.get("code", "").split("/")[-1]
+                snomed = code
+            if src == "ICD10CM" and icd10 == "N/A":
+                code = atom.get("code", "").split("/")[-1]
+                icd10 = code
+        _UMLS_ATOMS_CACHE.set(cui, (snomed, icd10))
+    return (snomed, icd10)
+
+
+async def _lookup_umls(client, api_key, keyword, sem):
+    """Search UMLS for a keyword.
+    Returns: (CUI, SNOMED_CODE, PREFERRED_NAME, ICD10_CODE)
+    """
+    res = ("N/A", "N/A", keyword, "N/A")
+    if not api_key or len(keyword) < 2:
+        return res
+
+    try:
+        top = await _umls_search(client, api_key, keyword, sem)
+        if top is None:
+            return res
+        cui, name = top
+        snomed, icd10 = await _umls_codes(client, api_key, cui, sem)
         return (cui, snomed, name, icd10)
 
     except Exception as e:
-        print(f"UMLS Error: {e}")
+        print(f"UMLS Error: {_umls_error_text(e)}")
         return res
 
 
+async def _lookup_umls_first(client, api_key, keywords, sem):
+    """First keyword, in order, whose UMLS concept has a SNOMED code.
+
+    Searches run concurrently; atoms are then fetched one concept at a
+    time and stop at the first SNOMED hit.
+    Returns: (CUI, SNOMED_CODE, PREFERRED_NAME, ICD10_CODE) or None
+    """
+    keywords = [k for k in keywords if len(k) >= 2]
+    if not api_key or not keywords:
+        return None
+
+    tops = await asyncio.gather(*[
+        _umls_search(client, api_key, k, sem) for k in keywords
+    ], return_exceptions=True)
+    for top in tops:
+        if isinstance(top, Exception):
+            print(f"UMLS Error: {_umls_error_text(top)}")
+            continue
+        if top is None:
+            continue
+        cui, name = top
+        try:
+            snomed, icd10 = await _umls_codes(client, api_key, cui, sem)
+        except Exception as e:
+            print(f"UMLS Error: {_umls_error_text(e)}")
+            continue
+        if snomed != "N/A":
+            return (cui, snomed, name, icd10)
+    return None
+
+
 # ===================================================================
 # Bridge context (ported from ablation/terminology_bridge.py)
 # ===================================================================
 
-@dataclass
+@dataclass(slots=True)
 class EntityITAMatch:
     entity: str
     umls_term: str
@@ -232,26 +475,42 @@ class EntityITAMatch:
     match_similarity: float
 
 
-@dataclass
+@dataclass(slots=True)
 class BridgeContext:
     entities: list
     ita_matches: list
     unmatched_entities: list
 
 
-def _build_bridge_context(nlp, ita_vocab, narrative, umls_api_key=None, threshold=FUZZY_THRESHOLD):
-    """Build terminology context: extract entities and match each to ITA."""
-    import requests
+async def _build_bridge_context(ita_vocab, entities, client, umls_sem,
+                                umls_api_key=None, threshold=FUZZY_THRESHOLD):
+    """Build terminology context: match each NER entity to ITA.
 
-    entities = _extract_entities(nlp, narrative)
+    UMLS preferred terms are only looked up for entities that are not
+    already an exact ITA English term.
+    """
     if not entities:
         return BridgeContext(entities=[], ita_matches=[], unmatched_entities=[])
 
+    # Issue every entity's UMLS search concurrently up front; matching
+    # below stays sequential so ITA de-duplication keeps entity order.
+    searches = [None] * len(entities)
+    if umls_api_key:
+        pending = [
+            i for i, e in enumerate(entities)
+            if e.lower().strip() not in ita_vocab.english_index
+        ]
+        results = await asyncio.gather(*[
+            _umls_search(client, umls_api_key, entities[i], umls_sem) for i in pending
+        ], return_exceptions=True)
+        for i, top in zip(pending, results):
+            searches[i] = top
+
     seen_ita_ids = set()
     ita_matches = []
     unmatched = []
 
-    for entity in entities:
+    for entity, top in zip(entities, searches):
         matched = False
 
         ita_match = ita_vocab.find_best_english_match(entity, threshold=threshold)
@@ -267,32 +526,22 @@ def _build_bridge_context(nlp, ita_vocab, narrative, umls_api_key=None, threshol
             matched = True
 
         # Try UMLS preferred term -> ITA
-        if umls_api_key:
-            try:
-                params = {
-                    "string": entity,
-                    "apiKey": umls_api_key,
-                    "returnIdType": "concept",
-                }
-                r = requests.get(UMLS_SEARCH_URL, params=params, timeout=UMLS_REQUEST_TIMEOUT)
-                if r.status_code == 200:
-                    results = r.json().get("result", {}).get("results", [])
-                    if results:
-                        umls_pref = results[0].get("name", "N/A")
-                        if umls_pref != "N/A":
-                            ita_match2 = ita_vocab.find_best_english_match(umls_pref, threshold=threshold)
-                            if ita_match2:
-                                ita_id2, eng2, skt2, sim2 = ita_match2
-                                if ita_id2 not in seen_ita_ids:
-                                    seen_ita_ids.add(ita_id2)
-                                    ita_matches.append(EntityITAMatch(
-                                        entity=entity, umls_term=umls_pref,
-                                        ita_id=ita_id2, english_term=eng2,
-                                        sanskrit_iast=skt2, match_similarity=sim2,
-                                    ))
-                                matched = True
-            except Exception as e:
-                print(f"  UMLS search error for '{entity}': {e}")
+        if isinstance(top, Exception):
+            print(f"  UMLS search error for '{entity}': {_umls_error_text(top)}")
+        elif top:
+            umls_pref = top[1] or "N/A"
+            if umls_pref != "N/A":
+                ita_match2 = ita_vocab.find_best_english_match(umls_pref, threshold=threshold)
+                if ita_match2:
+                    ita_id2, eng2, skt2, sim2 = ita_match2
+                    if ita_id2 not in seen_ita_ids:
+                        seen_ita_ids.add(ita_id2)
+                        ita_matches.append(EntityITAMatch(
+                            entity=entity, umls_term=umls_pref,
+                            ita_id=ita_id2, english_term=eng2,
+                            sanskrit_iast=skt2, match_similarity=sim2,
+                        ))
+                    matched = True
 
         if not matched:
             unmatched.append(entity)
@@ -364,6 +613,9 @@ def _build_few_shot_block():
     return "\n".join(lines)
 
 
+_FEW_SHOT_BLOCK = _build_few_shot_block()
+
+
 def _build_ita_dictionary_block(bridge_context):
     if not bridge_context.ita_matches:
         return ""
@@ -387,10 +639,14 @@ def _build_entities_block(bridge_context):
     )
 
 
+_THINK_BLOCK_RE = re.compile(r"<think>.*?</think>", re.DOTALL)
+_THINK_TRAIL_RE = re.compile(r"<think>.*", re.DOTALL)
+
+
 def _strip_thinking(text):
     """Strip <think>...</think> blocks from Qwen3 responses."""
-    text = re.sub(r"<think>.*?</think>", "", text, flags=re.DOTALL)
-    text = re.sub(r"<think>.*", "", text, flags=re.DOTALL)
+    text = _THINK_BLOCK_RE.sub("", text)
+    text = _THINK_TRAIL_RE.sub("", text)
     return text.strip()
 
 
@@ -398,18 +654,25 @@ def _strip_thinking(text):
 # Input cleaning (from aravind's main.py)
 # ===================================================================
 
+_FILLERS = [
+    "i am", "i'm", "i have", "i've", "i feel", "i think", "why do", "what is",
+    "having", "feeling", "suffering", "diagnosed", "with", "from",
+    "severe", "mild", "acute", "chronic", "very", "bad", "really",
+    "my", "the", "a", "an", "and", "or", "in", "on", "at", "to",
+]
+# One alternation, longest first so "i have" wins over shorter overlaps.
+_FILLER_RE = re.compile(
+    r"\b(?:"
+    + "|".join(re.escape(f) for f in sorted(_FILLERS, key=len, reverse=True))
+    + r")\b"
+)
+_NON_WORD_RE = re.compile(r"[^\w\s]")
+
+
 def _clean_input_smart(text):
     """Remove conversational filler so we are left with the core medical concept."""
-    t = text.lower()
-    fillers = [
-        "i am", "i'm", "i have", "i've", "i feel", "i think", "why do", "what is",
-        "having", "feeling", "suffering", "diagnosed", "with", "from",
-        "severe", "mild", "acute", "chronic", "very", "bad", "really",
-        "my", "the", "a", "an", "and", "or", "in", "on", "at", "to",
-    ]
-    for f in fillers:
-        t = re.sub(r'\b' + re.escape(f) + r'\b', '', t)
-    t = re.sub(r'[^\w\s]', '', t)
+    t = _FILLER_RE.sub("", text.lower())
+    t = _NON_WORD_RE.sub("", t)
     return t.strip()
 
 
@@ -417,31 +680,35 @@ def _clean_input_smart(text):
 # 13-question protocol (adapted from aravind's main.py)
 # ===================================================================
 
+_AYUR_SYSTEM_PREFIX = "You are an expert Ayurvedic physician."
+
+
 def _build_questions(condition, original_text, ita_dict_block=""):
     """Standard Ayurvedic Clinical Assessment Protocol — 13 questions."""
     ita_context = f"\n\n{ita_dict_block}" if ita_dict_block else ""
+    ayur = f"{_AYUR_SYSTEM_PREFIX}{ita_context}\n\n"
     return [
         # Q0: overview_dosha_causes
         (
-            f"You are an expert Ayurvedic physician.{ita_context}\n\n"
+            f"{ayur}"
             f"The patient reports: '{original_text}'. Focusing on '{condition}', "
             f"explain the Ayurvedic perspective (Nidana/Pathogenesis). "
             f"Which Doshas are aggravated? List the main causes."
         ),
         # Q1: symptoms
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nWhat are the main symptoms (Rupa) of '{condition}' in Ayurveda?",
+        f"{ayur}What are the main symptoms (Rupa) of '{condition}' in Ayurveda?",
         # Q2: single_drug_remedies
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nList 3 specific single-herb remedies (Eka Mulika / Ottamooli) for '{condition}'. For each give: name, Sanskrit name, part used, preparation, dosage, and duration.",
+        f"{ayur}List 3 specific single-herb remedies (Eka Mulika / Ottamooli) for '{condition}'. For each give: name, Sanskrit name, part used, preparation, dosage, and duration.",
         # Q3: classical_formulations
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nSuggest 2-3 classical Ayurvedic formulations (Yogas) for '{condition}'. Give name, form, dosage, and reference text.",
+        f"{ayur}Suggest 2-3 classical Ayurvedic formulations (Yogas) for '{condition}'. Give name, form, dosage, and reference text.",
         # Q4: panchakarma
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nWhat Panchakarma therapies are indicated for '{condition}'?",
+        f"{ayur}What Panchakarma therapies are indicated for '{condition}'?",
         # Q5: diet_lifestyle
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nProvide dietary advice (Pathya/Apathya) and lifestyle recommendations for '{condition}'.",
+        f"{ayur}Provide dietary advice (Pathya/Apathya) and lifestyle recommendations for '{condition}'.",
         # Q6: yoga
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nWhat Yoga Asanas or Pranayama are beneficial for '{condition}'?",
+        f"{ayur}What Yoga Asanas or Pranayama are beneficial for '{condition}'?",
         # Q7: prognosis
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nWhat is the prognosis (Sadhya/Asadhya) for '{condition}'?",
+        f"{ayur}What is the prognosis (Sadhya/Asadhya) for '{condition}'?",
         # Q8: modern_correlation_warnings
         (
             f"You are a medical expert with knowledge of both Ayurveda and modern medicine.{ita_context}\n\n"
@@ -451,16 +718,20 @@ def _build_questions(condition, original_text, ita_dict_block=""):
             f"3) What are the danger signs or red flags requiring immediate medical attention?"
         ),
         # Q9: differential_diagnosis
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nWhat is the Differential Diagnosis (Vyavachedaka Nidana) in Ayurveda for '{condition}'?",
+        f"{ayur}What is the Differential Diagnosis (Vyavachedaka Nidana) in Ayurveda for '{condition}'?",
         # Q10: investigations_labs
         f"You are a medical expert.{ita_context}\n\nWhat modern lab investigations are recommended for '{condition}'?",
         # Q11: prevention_recurrence
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nSuggest Rasayana (Rejuvenation) therapy to prevent recurrence of '{condition}'.",
+        f"{ayur}Suggest Rasayana (Rejuvenation) therapy to prevent recurrence of '{condition}'.",
         # Q12: psychotherapy_satvavajaya
-        f"You are an expert Ayurvedic physician.{ita_context}\n\nIs there a psychosomatic component (Manasika Dosha) to '{condition}'? Suggest Satvavajaya (counseling) measures.",
+        f"{ayur}Is there a psychosomatic component (Manasika Dosha) to '{condition}'? Suggest Satvavajaya (counseling) measures.",
     ]
 
 
+# Questions that only need the condition name, not the Ayurvedic diagnosis,
+# so analyze() can start them on a resolved UMLS concept while the passes run.
+_STATIC_QUESTIONS = (1, 4, 5, 6, 7, 11, 12)
+
 RESPONSE_KEYS = [
     "overview_dosha_causes",
     "symptoms",
@@ -477,14 +748,19 @@ RESPONSE_KEYS = [
     "psychotherapy_satvavajaya",
 ]
 
+DISCLAIMER = (
+    "This information is for educational purposes only. "
+    "Consult a qualified Ayurvedic practitioner."
+)
+
 
 # ===================================================================
 # Groq API call wrapper
 # ===================================================================
 
-def _call_groq_sync(client, prompt):
+async def _call_groq(client, prompt):
     """Call Qwen3 via Groq API (reasoning disabled for speed)."""
-    resp = client.chat.completions.create(
+    resp = await client.chat.completions.create(
         model=GROQ_MODEL,
         messages=[{"role": "user", "content": prompt}],
         temperature=LLM_TEMPERATURE,
@@ -499,33 +775,73 @@ def _call_groq_sync(client, prompt):
 # ASGI app
 # ===================================================================
 
+def _warm_up(nlp, ita_vocab):
+    """Push one representative narrative through NER and the ITA matcher so
+    the first real request doesn't pay first-call import/allocation costs."""
+    entities, _ = _extract_entities(nlp(FEW_SHOT_EXAMPLES[0]["narrative"]))
+    for entity in entities:
+        ita_vocab.find_best_english_match(entity, threshold=FUZZY_THRESHOLD)
+
+
 @asynccontextmanager
 async def lifespan(web_app):
-    import spacy
+    # NER and ITA are loaded in AyurAssistService.load (memory snapshot);
+    # the HTTP clients and secrets are per-container and set up here.
+    from groq import AsyncGroq
 
-    web_app.state.ner = await asyncio.to_thread(spacy.load, NER_MODEL_NAME)
-    web_app.state.ita_vocab = await asyncio.to_thread(ITAVocabulary)
     web_app.state.umls_api_key = os.environ.get("UMLS_API_KEY", "")
-    web_app.state.groq_api_key = os.environ.get("GROQ_API_KEY", "")
+    web_app.state.groq = AsyncGroq(api_key=os.environ.get("GROQ_API_KEY", ""))
+    web_app.state.http = _make_umls_client()
+    # Container-wide cap on in-flight UMLS calls; the HTTP/2 pool alone
+    # would multiplex them all over one connection.
+    web_app.state.umls_sem = asyncio.Semaphore(UMLS_MAX_CONCURRENCY)
+    web_app.state.ner_batcher = NERBatcher(web_app.state.ner)
+    web_app.state.ner_batcher.start()
     print("CPU engine ready (NER + ITA + Groq).")
     yield
+    await web_app.state.ner_batcher.stop()
+    await web_app.state.http.aclose()
+    await web_app.state.groq.close()
 
 
-@app.function(
+@app.cls(
     image=cpu_image,
     timeout=CPU_TIMEOUT,
     scaledown_window=CPU_SCALEDOWN_WINDOW,
+    enable_memory_snapshot=True,
     secrets=[
         modal.Secret.from_name(MODAL_SECRET_UMLS),
         modal.Secret.from_name(MODAL_SECRET_GROQ),
     ],
 )
-@modal.asgi_app()
-def fastapi_app():
+@modal.concurrent(max_inputs=CPU_MAX_CONCURRENT_INPUTS)
+class AyurAssistService:
+    @modal.enter(snap=True)
+    def load(self):
+        """Load NER + ITA before the snapshot so cold starts restore them
+        from memory instead of re-reading en_core_sci_lg from disk."""
+        import spacy
+
+        # Only doc.ents is used; the excluded components are never loaded.
+        # tok2vec stays in case the NER listens to it, and the parser stays
+        # because its sentence boundaries constrain the NER.
+        self.ner = spacy.load(NER_MODEL_NAME, exclude=NER_EXCLUDED_COMPONENTS)
+        self.ita_vocab = ITAVocabulary()
+        _warm_up(self.ner, self.ita_vocab)
+
+    @modal.asgi_app(label=MODAL_WEB_LABEL)
+    def fastapi_app(self):
+        return _create_web_app(self.ner, self.ita_vocab)
+
+
+def _create_web_app(ner, ita_vocab):
     from fastapi import FastAPI, Request, HTTPException
     from fastapi.middleware.cors import CORSMiddleware
+    from fastapi.responses import ORJSONResponse
 
-    web = FastAPI(lifespan=lifespan)
+    web = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+    web.state.ner = ner
+    web.state.ita_vocab = ita_vocab
     web.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],
@@ -540,8 +856,8 @@ def fastapi_app():
 
     @web.post("/")
     async def analyze(request: Request):
-        from groq import Groq
-
+        phrase_umls_task = None
+        question_tasks = {}
         try:
             body = await request.json()
             user_input = body.get("text", "").strip()
@@ -550,35 +866,37 @@ def fastapi_app():
 
             st = request.app.state
 
-            # --- 1. Clean input and run NER ---
+            # --- 1. Clean input; start the phrase UMLS lookup, run NER ---
             cleaned_phrase = _clean_input_smart(user_input)
 
-            entity_dicts = await asyncio.to_thread(
-                _extract_entity_dicts, st.ner, user_input
+            # The cleaned-phrase lookup doesn't depend on NER, so its
+            # round trips overlap with steps 1-2.
+            phrase_umls_task = asyncio.create_task(
+                _lookup_umls(st.http, st.umls_api_key, cleaned_phrase, st.umls_sem)
             )
 
+            doc = await st.ner_batcher.submit(user_input)
+            entities, entity_dicts = _extract_entities(doc)
+
             # --- 2. Build ITA bridge context (NER -> UMLS -> ITA) ---
-            bridge_ctx = await asyncio.to_thread(
-                _build_bridge_context,
-                st.ner, st.ita_vocab, user_input,
+            bridge_ctx = await _build_bridge_context(
+                st.ita_vocab, entities, st.http, st.umls_sem,
                 umls_api_key=st.umls_api_key,
                 threshold=FUZZY_THRESHOLD,
             )
 
             # --- 3. UMLS lookup for the cleaned phrase ---
-            cui, snomed, preferred_name, icd10 = await asyncio.to_thread(
-                _lookup_umls, st.umls_api_key, cleaned_phrase
-            )
+            cui, snomed, preferred_name, icd10 = await phrase_umls_task
 
-            # If phrase lookup failed, try NER entities
+            # If phrase lookup failed, try NER entities (longest first)
             if snomed == "N/A" and bridge_ctx.entities:
-                for entity in sorted(bridge_ctx.entities, key=len, reverse=True):
-                    e_cui, e_snomed, e_name, e_icd = await asyncio.to_thread(
-                        _lookup_umls, st.umls_api_key, entity
-                    )
-                    if e_snomed != "N/A":
-                        cui, snomed, preferred_name, icd10 = e_cui, e_snomed, e_name, e_icd
-                        break
+                fallback = await _lookup_umls_first(
+                    st.http, st.umls_api_key,
+                    sorted(bridge_ctx.entities, key=len, reverse=True),
+                    st.umls_sem,
+                )
+                if fallback:
+                    cui, snomed, preferred_name, icd10 = fallback
 
             condition_name = preferred_name if preferred_name != "N/A" else (cleaned_phrase or user_input)
 
@@ -594,12 +912,34 @@ def fastapi_app():
                     "description": "",
                 }
 
-            # --- 5. Three-pass diagnosis (sequential with rate limiting) ---
-            groq_client = Groq(api_key=st.groq_api_key)
-
             entities_block = _build_entities_block(bridge_ctx)
             ita_dict_block = _build_ita_dictionary_block(bridge_ctx)
-            few_shot_block = _build_few_shot_block()
+            few_shot_block = _FEW_SHOT_BLOCK
+
+            sem = asyncio.Semaphore(5)
+
+            async def _call_with_limit(prompt):
+                async with sem:
+                    try:
+                        result = await _call_groq(st.groq, prompt)
+                        return result
+                    except Exception as e:
+                        print(f"Groq question error: {e}")
+                        return ""
+
+            # --- 5. Static detail questions, started on the UMLS concept ---
+            # Without a concept condition_name is just the cleaned input, so
+            # they wait for the Ayurvedic diagnosis like the rest.
+            if cui != "N/A":
+                static_questions = _build_questions(
+                    condition_name, user_input, ita_dict_block=ita_dict_block,
+                )
+                question_tasks = {
+                    i: asyncio.create_task(_call_with_limit(static_questions[i]))
+                    for i in _STATIC_QUESTIONS
+                }
+
+            # --- 6. Three-pass diagnosis (sequential with rate limiting) ---
 
             # PASS 1: Modern diagnosis
             modern_prompt = (
@@ -613,9 +953,7 @@ def fastapi_app():
             )
             modern_diagnosis = ""
             try:
-                modern_diagnosis = await asyncio.to_thread(
-                    _call_groq_sync, groq_client, modern_prompt
-                )
+                modern_diagnosis = await _call_groq(st.groq, modern_prompt)
             except Exception as e:
                 print(f"Modern diagnosis error: {e}")
 
@@ -639,9 +977,7 @@ def fastapi_app():
             )
             ayur_diagnosis = ""
             try:
-                ayur_diagnosis = await asyncio.to_thread(
-                    _call_groq_sync, groq_client, ayur_diag_prompt
-                )
+                ayur_diagnosis = await _call_groq(st.groq, ayur_diag_prompt)
             except Exception as e:
                 print(f"Ayurvedic diagnosis error: {e}")
 
@@ -664,9 +1000,7 @@ def fastapi_app():
             )
             ayur_treatment = ""
             try:
-                ayur_treatment = await asyncio.to_thread(
-                    _call_groq_sync, groq_client, ayur_treat_prompt
-                )
+                ayur_treatment = await _call_groq(st.groq, ayur_treat_prompt)
             except Exception as e:
                 print(f"Ayurvedic treatment error: {e}")
 
@@ -676,31 +1010,21 @@ def fastapi_app():
             if csv_match:
                 sanskrit_name = csv_match.get("sanskrit_iast", "")
 
-            # --- 6. 13 detail questions (parallel with semaphore) ---
+            # --- 7. Remaining detail questions on the Ayurvedic diagnosis ---
             questions = _build_questions(
                 ayur_condition or condition_name,
                 user_input,
                 ita_dict_block=ita_dict_block,
             )
-
-            sem = asyncio.Semaphore(5)
-
-            async def _call_with_limit(prompt):
-                async with sem:
-                    try:
-                        result = await asyncio.to_thread(
-                            _call_groq_sync, groq_client, prompt
-                        )
-                        return result
-                    except Exception as e:
-                        print(f"Groq question error: {e}")
-                        return ""
+            for i, q in enumerate(questions):
+                if i not in question_tasks:
+                    question_tasks[i] = asyncio.create_task(_call_with_limit(q))
 
             responses = await asyncio.gather(*[
-                _call_with_limit(q) for q in questions
+                question_tasks[i] for i in range(len(questions))
             ])
 
-            # --- 7. Assemble response ---
+            # --- 8. Assemble response ---
             ayurparam_responses = {}
             for key, resp in zip(RESPONSE_KEYS, responses):
                 ayurparam_responses[key] = resp
@@ -708,7 +1032,7 @@ def fastapi_app():
             treatment_info = {
                 "condition_name": ayur_condition or condition_name,
                 "sanskrit_name": sanskrit_name,
-                "disclaimer": "This information is for educational purposes only. Consult a qualified Ayurvedic practitioner.",
+                "disclaimer": DISCLAIMER,
                 "ayurparam_responses": ayurparam_responses,
             }
 
@@ -735,5 +1059,11 @@ def fastapi_app():
         except Exception as e:
             print(f"Request error: {e}")
             raise HTTPException(status_code=500, detail=str(e))
+        finally:
+            # On cancellation, timeout or an early error, stop background
+            # UMLS/Groq calls whose results nobody will read.
+            for task in (phrase_umls_task, *question_tasks.values()):
+                if task is not None and not task.done():
+                    task.cancel()
 
     return web